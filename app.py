@@ -1,11 +1,29 @@
 import os
+
+# Must run before anything imports socket/ssl so blocking I/O yields to gevent
+if os.getenv("GEVENT"):
+    from gevent import monkey
+    monkey.patch_all()
+
+import re
+import hashlib
 import time
 import pathlib
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 
+import orjson
 import requests
-from flask import Flask, render_template, request, redirect, url_for, flash
+from cachetools import LRUCache, TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+from flask_caching import Cache
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 
 
@@ -14,13 +32,76 @@ DATA_DIR = APP_DIR / "data"
 DB_PATH = DATA_DIR / "app.db"
 DB_URI = f"sqlite:///{DB_PATH}"
 
+# Current UNIX time in seconds, filled in by SQLite on insert
+UNIX_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
 app = Flask(__name__)
 app.secret_key = "replace-with-a-real-secret-for-prod"
 app.config["SQLALCHEMY_DATABASE_URI"] = DB_URI
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_pre_ping": False,
+    "connect_args": {"check_same_thread": False},
+}
 
 db = SQLAlchemy(app)
 
+# File-backed so every Gunicorn worker sees the same entries and invalidations
+app.config["CACHE_TYPE"] = "FileSystemCache"
+app.config["CACHE_DIR"] = str(DATA_DIR / "cache")
+cache = Cache(app)
+
+
+# WAL lets readers carry on while a favourite/review is being written
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA cache_size=-20000")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.close()
+
+
+with app.app_context():
+    event.listen(db.engine, "connect", _sqlite_pragmas)
+
+
+# Shared HTTP session so connections to Steam/YouTube are kept alive and reused
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "GamesHub/1.0"
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# Worker pool for fanning out Steam lookups concurrently
+EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+# In-process caches for Steam data that only changes every few minutes
+_GAME_CACHE = TTLCache(maxsize=4096, ttl=600)
+_TOP_SELLERS_CACHE = TTLCache(maxsize=16, ttl=300)
+_CACHE_LOCK = threading.Lock()
+
+# YouTube trailer lookups by game name; misses are retried after an hour
+_YT_TRAILER_CACHE = LRUCache(maxsize=2048)
+_YT_MISS_CACHE = TTLCache(maxsize=2048, ttl=3600)
+_YT_TIMEOUT = 3
+
+# Separate from EXECUTOR so slow YouTube lookups never hold up Steam fan-out
+_YT_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+# Matches YouTube video ids in the raw bytes of a results page
+_YT_ID_RE = re.compile(rb"watch\?v=([A-Za-z0-9_-]{11})")
+_YT_OVERLAP = len(b"watch?v=") + 11 - 1
+_YT_MAX_BYTES = 512 * 1024
+
+# Steam movie formats to try for a trailer, best first
+_TRAILER_PATHS = (("webm", "max"), ("webm", "480"), ("mp4", "max"), ("mp4", "480"))
+
 
 
 
@@ -28,30 +109,21 @@ db = SQLAlchemy(app)
 
 class Favourite(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    appid = db.Column(db.Integer, nullable=False, index=True)
+    appid = db.Column(db.Integer, nullable=False, unique=True, index=True)
     name = db.Column(db.String(512), nullable=False)
     image = db.Column(db.String(1024))
-    added_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    def to_dict(self):
-        return {"appid": self.appid, "name": self.name, "image": self.image}
+    added_at = db.Column(db.Integer, nullable=False, server_default=db.text(UNIX_NOW))
 
 
 class Review(db.Model):
+    # Covers the per-game "newest first" listing without a separate sort
+    __table_args__ = (db.Index("ix_review_appid_created", "appid", "created_at"),)
+
     id = db.Column(db.Integer, primary_key=True)
-    appid = db.Column(db.Integer, nullable=False, index=True)
+    appid = db.Column(db.Integer, nullable=False)
     rating = db.Column(db.Integer, nullable=False)
     text = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "appid": self.appid,
-            "rating": self.rating,
-            "text": self.text,
-            "created_at": int(self.created_at.timestamp()),
-        }
+    created_at = db.Column(db.Integer, nullable=False, server_default=db.text(UNIX_NOW))
 
 
 
@@ -69,33 +141,82 @@ def init_db():
         db.create_all()
 
 
+def upgrade_db():
+    """Brings tables created by older versions of the app up to the current schema."""
+    with db.engine.begin() as conn:
+        _ensure_unique_favourite_appid(conn)
+        _ensure_unix_timestamp(conn, Favourite.__table__, "added_at")
+        _ensure_unix_timestamp(conn, Review.__table__, "created_at")
+
+        # The single-column review index is covered by the composite one
+        conn.execute(db.text("DROP INDEX IF EXISTS ix_review_appid"))
+        conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_review_appid_created ON review (appid, created_at)"))
+
+
+def _ensure_unique_favourite_appid(conn):
+    indexes = conn.execute(db.text("PRAGMA index_list(favourite)")).mappings().all()
+    if any(ix["name"] == "ix_favourite_appid" and ix["unique"] for ix in indexes):
+        return
+
+    # Keep the earliest row for each game before enforcing uniqueness
+    conn.execute(db.text("DELETE FROM favourite WHERE id NOT IN (SELECT MIN(id) FROM favourite GROUP BY appid)"))
+    conn.execute(db.text("DROP INDEX IF EXISTS ix_favourite_appid"))
+    conn.execute(db.text("CREATE UNIQUE INDEX ix_favourite_appid ON favourite (appid)"))
+
+
+def _ensure_unix_timestamp(conn, table, column):
+    # Older tables stored DATETIME strings with no SQL default. SQLite cannot
+    # change a column's default in place, so rebuild the table from the model.
+    info = conn.execute(db.text(f"PRAGMA table_info({table.name})")).mappings().all()
+    if any(col["name"] == column and col["dflt_value"] is not None for col in info):
+        return
+
+    for ix in conn.execute(db.text(f"PRAGMA index_list({table.name})")).mappings().all():
+        if ix["origin"] == "c":
+            conn.execute(db.text(f'DROP INDEX "{ix["name"]}"'))
+    conn.execute(db.text(f"ALTER TABLE {table.name} RENAME TO {table.name}_old"))
+    table.create(conn)
+
+    names = [c.name for c in table.columns]
+    values = [
+        f"COALESCE(CAST(strftime('%s', {name}) AS INTEGER), {UNIX_NOW})" if name == column else name
+        for name in names
+    ]
+    conn.execute(db.text(
+        f"INSERT INTO {table.name} ({', '.join(names)}) "
+        f"SELECT {', '.join(values)} FROM {table.name}_old"
+    ))
+    conn.execute(db.text(f"DROP TABLE {table.name}_old"))
+
+
 
 
 # Favourites
 
 
 def get_all_favourites():
-    rows = Favourite.query.order_by(Favourite.added_at.desc()).all()
-    return [r.to_dict() for r in rows]
+    stmt = (
+        select(Favourite.appid, Favourite.name, Favourite.image)
+        .order_by(Favourite.added_at.desc(), Favourite.id.desc())
+    )
+    return [dict(row) for row in db.session.execute(stmt).mappings()]
 
 
 def add_favourite_db(appid, name, image):
-    existing = Favourite.query.filter_by(appid=int(appid)).first()
-    if existing:
-        return False
-    fav = Favourite(appid=int(appid), name=name, image=image)
-    db.session.add(fav)
+    stmt = (
+        sqlite_insert(Favourite)
+        .values(appid=int(appid), name=name, image=image)
+        .on_conflict_do_nothing(index_elements=["appid"])
+    )
+    result = db.session.execute(stmt)
     db.session.commit()
-    return True
+    return result.rowcount == 1
 
 
 def remove_favourite_db(appid):
-    row = Favourite.query.filter_by(appid=int(appid)).first()
-    if not row:
-        return False
-    db.session.delete(row)
+    result = db.session.execute(delete(Favourite).where(Favourite.appid == int(appid)))
     db.session.commit()
-    return True
+    return result.rowcount > 0
 
 
 
@@ -104,13 +225,16 @@ def remove_favourite_db(appid):
 
 
 def get_reviews_for_app(appid):
-    rows = Review.query.filter_by(appid=int(appid)).order_by(Review.created_at.desc()).all()
-    return [r.to_dict() for r in rows]
+    stmt = (
+        select(Review.id, Review.appid, Review.rating, Review.text, Review.created_at)
+        .where(Review.appid == int(appid))
+        .order_by(Review.created_at.desc(), Review.id.desc())
+    )
+    return [dict(row) for row in db.session.execute(stmt).mappings()]
 
 
 def add_review_db(appid, rating, text):
-    r = Review(appid=int(appid), rating=int(rating), text=text.strip())
-    db.session.add(r)
+    db.session.execute(insert(Review).values(appid=int(appid), rating=int(rating), text=text.strip()))
     db.session.commit()
     return True
 
@@ -121,18 +245,58 @@ def add_review_db(appid, rating, text):
 
 
 def search_youtube_trailer(game_name):
-    """Finds the first YouTube trailer result for the game."""
+    """Finds the first YouTube trailer result for the game, giving up after a few seconds."""
+    with _CACHE_LOCK:
+        if game_name in _YT_TRAILER_CACHE:
+            return _YT_TRAILER_CACHE[game_name]
+        if game_name in _YT_MISS_CACHE:
+            return None
+
+    # Run on the pool so the deadline also covers a socket that hangs mid-read
+    future = _YT_EXECUTOR.submit(_search_youtube_trailer, game_name)
+    try:
+        trailer = future.result(timeout=_YT_TIMEOUT)
+    except FutureTimeoutError:
+        # A lookup still waiting for a worker is dropped, not remembered as a miss
+        if future.cancel():
+            return None
+        # One already running records its own outcome once it finishes
+        future.add_done_callback(lambda f: _remember_trailer(game_name, f.result()))
+        return None
+
+    _remember_trailer(game_name, trailer)
+    return trailer
+
+
+def _remember_trailer(game_name, trailer):
+    with _CACHE_LOCK:
+        if trailer:
+            _YT_TRAILER_CACHE[game_name] = trailer
+            _YT_MISS_CACHE.pop(game_name, None)
+        else:
+            _YT_MISS_CACHE[game_name] = True
+
+
+def _search_youtube_trailer(game_name):
+    deadline = time.monotonic() + _YT_TIMEOUT
     try:
         q = f"{game_name} official trailer"
         url = f"https://www.youtube.com/results?search_query={requests.utils.quote(q)}"
-        r = requests.get(url, timeout=10)
-        
-        # Look for video IDs
-        import re
-        match = re.search(r"watch\?v=([A-Za-z0-9_-]{11})", r.text)
-        if match:
-            video_id = match.group(1)
-            return f"https://www.youtube.com/embed/{video_id}"
+        with SESSION.get(url, timeout=_YT_TIMEOUT, stream=True) as r:
+            # Scan the page as it arrives and stop at the first video ID,
+            # keeping a short tail so an ID split across chunks still matches
+            buf = b""
+            read = 0
+            for chunk in r.iter_content(chunk_size=65536):
+                buf += chunk
+                read += len(chunk)
+                match = _YT_ID_RE.search(buf)
+                if match:
+                    video_id = match.group(1).decode("ascii")
+                    return f"https://www.youtube.com/embed/{video_id}"
+                if read >= _YT_MAX_BYTES or time.monotonic() > deadline:
+                    break
+                buf = buf[-_YT_OVERLAP:]
     except:
         pass
     return None
@@ -144,45 +308,39 @@ def search_youtube_trailer(game_name):
 
 
 def get_steam_game(appid, lang="english"):
+    """Full game details for the detail page, with a YouTube trailer fallback."""
+    game = get_steam_game_fast(appid, lang)
+    if game is not None and not game["trailer_url"]:
+        game = {**game, "trailer_url": search_youtube_trailer(game["name"])}
+    return game
+
+
+def get_steam_game_fast(appid, lang="english"):
+    """Steam-only game details, never waits on YouTube."""
+    key = (str(appid), lang)
+    with _CACHE_LOCK:
+        if key in _GAME_CACHE:
+            return _GAME_CACHE[key]
+
+    game = _fetch_steam_game(appid, lang)
+    if game is not None:
+        with _CACHE_LOCK:
+            _GAME_CACHE[key] = game
+    return game
+
+
+def get_steam_games(appids, lang="english"):
+    """Steam-only details for several games, looked up concurrently."""
+    return list(EXECUTOR.map(functools.partial(get_steam_game_fast, lang=lang), appids))
+
+
+def _fetch_steam_game(appid, lang="english"):
     try:
         url = f"https://store.steampowered.com/api/appdetails?appids={appid}&l={lang}"
-        r = requests.get(url, timeout=8)
+        r = SESSION.get(url, timeout=8)
         r.raise_for_status()
-        j = r.json()
-        key = str(appid)
-
-        if key in j and j[key].get("success"):
-            d = j[key]["data"]
-            header_image = d.get("header_image")
-            short = d.get("short_description") or ""
-            genres = [g.get("description") for g in d.get("genres", [])]
-            price = d.get("price_overview", {}).get("final_formatted") or ("Free" if d.get("is_free") else "—")
-
-            # Steam trailer attempt
-            trailer = None
-            movies = d.get("movies") or []
-            if movies:
-                first = movies[0]
-                webm = first.get("webm") or {}
-                trailer = webm.get("max") or webm.get("480")
-                if not trailer:
-                    mp4 = first.get("mp4") or {}
-                    trailer = mp4.get("max") or mp4.get("480")
-
-            # if Steam trailer missing, use YouTube fallback
-            if not trailer:
-                trailer = search_youtube_trailer(d.get("name"))
-
-            return {
-                "appid": appid,
-                "name": d.get("name"),
-                "short_description": short,
-                "header_image": header_image,
-                "genres": genres,
-                "price": price,
-                "store_link": f"https://store.steampowered.com/app/{appid}",
-                "trailer_url": trailer,
-            }
+        j = orjson.loads(r.content)
+        return _parse_steam_game(appid, j.get(str(appid)))
 
     except Exception as e:
         print(f"[get_steam_game] error for {appid}: {e}")
@@ -190,35 +348,65 @@ def get_steam_game(appid, lang="english"):
     return None
 
 
+def _parse_steam_game(appid, entry):
+    if not entry or not entry.get("success"):
+        return None
+
+    d = entry["data"]
+    header_image = d.get("header_image")
+    short = d.get("short_description") or ""
+    genres = [g.get("description") for g in d.get("genres", [])]
+    price = d.get("price_overview", {}).get("final_formatted") or ("Free" if d.get("is_free") else "—")
+
+    # Steam trailer attempt
+    trailer = None
+    if movies := d.get("movies"):
+        first = movies[0]
+        trailer = next(
+            (url for fmt, size in _TRAILER_PATHS if (url := (first.get(fmt) or {}).get(size))),
+            None,
+        )
+
+    return {
+        "appid": appid,
+        "name": d.get("name"),
+        "short_description": short,
+        "header_image": header_image,
+        "genres": genres,
+        "price": price,
+        "store_link": f"https://store.steampowered.com/app/{appid}",
+        "trailer_url": trailer,
+    }
+
+
 
 def fetch_top_sellers(limit=9):
+    with _CACHE_LOCK:
+        if limit in _TOP_SELLERS_CACHE:
+            return _TOP_SELLERS_CACHE[limit]
+
+    sellers = _fetch_top_sellers(limit)
+    if sellers:
+        with _CACHE_LOCK:
+            _TOP_SELLERS_CACHE[limit] = sellers
+    return sellers
+
+
+def _fetch_top_sellers(limit=9):
     try:
         url = "https://store.steampowered.com/api/featuredcategories"
-        r = requests.get(url, timeout=8)
+        r = SESSION.get(url, timeout=8)
         r.raise_for_status()
-        j = r.json()
-
-        sellers = []
-        for key, val in j.items():
-            if isinstance(val, list) and val and isinstance(val[0], dict):
-                for item in val:
-                    appid = item.get("id") or item.get("appid")
-                    if appid:
-                        sellers.append(int(appid))
-
-            if isinstance(val, dict) and isinstance(val.get("items"), list):
-                for it in val["items"]:
-                    appid = it.get("id") or it.get("appid")
-                    if appid:
-                        sellers.append(int(appid))
+        j = orjson.loads(r.content)
 
         out = []
         seen = set()
 
-        for a in sellers:
-            if a not in seen:
-                out.append(a)
-                seen.add(a)
+        for a in _iter_featured_appids(j):
+            if a in seen:
+                continue
+            seen.add(a)
+            out.append(a)
             if len(out) >= limit:
                 break
 
@@ -227,28 +415,102 @@ def fetch_top_sellers(limit=9):
         return []
 
 
+def _iter_featured_appids(j):
+    """Yields appids from every category in a featuredcategories response."""
+    for val in j.values():
+        if isinstance(val, list):
+            items = val
+        elif isinstance(val, dict):
+            items = val.get("items")
+        else:
+            items = None
+        if not isinstance(items, list):
+            continue
+
+        for it in items:
+            if not isinstance(it, dict):
+                continue
+            appid = it.get("id") or it.get("appid")
+            if appid:
+                yield int(appid)
+
+
 
 
 # Jinja Filter
 
 
+@functools.lru_cache(maxsize=4096)
+def _format_timestamp(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+
+
 @app.template_filter("datetimeformat")
 def datetimeformat(value):
+    if isinstance(value, int):
+        return _format_timestamp(value)
     try:
-        return datetime.fromtimestamp(int(value)).strftime("%Y-%m-%d %H:%M")
+        return _format_timestamp(int(value))
     except:
         return value
 
 
 
 
+# HTTP Caching
+
+
+# Cache-Control per endpoint. Pages always revalidate so a flash message or a
+# freshly posted review shows up straight away; unchanged pages still get a 304.
+HTTP_CACHE_CONTROL = {
+    "index": "public, no-cache",
+    "game_detail": "public, no-cache",
+}
+
+
+def _has_flashes():
+    return "_flashes" in session
+
+
+def _game_detail_cache_key(appid):
+    return f"game_detail/{appid}"
+
+
+def _cacheable_view(rv):
+    # Only keep real pages, never a redirect or a page rendered while Steam was down
+    return getattr(rv, "status_code", 200) == 200 and not g.get("skip_view_cache")
+
+
+@app.after_request
+def add_http_caching(response):
+    cache_control = HTTP_CACHE_CONTROL.get(request.endpoint)
+    # Skip pages that consumed a flash message or were rendered without Steam data
+    if (
+        cache_control is None
+        or request.method != "GET"
+        or response.status_code != 200
+        or session.modified
+        or g.get("skip_view_cache")
+    ):
+        return response
+
+    response.headers["Cache-Control"] = cache_control
+    response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
+    return response.make_conditional(request)
+
+
+
+
 # Routes
 
 
 @app.route("/")
+@cache.cached(timeout=300, unless=_has_flashes, response_filter=_cacheable_view)
 def index():
     top_ids = fetch_top_sellers(limit=9)
-    games = [get_steam_game(aid) for aid in top_ids if get_steam_game(aid)]
+    games = [game for game in get_steam_games(top_ids) if game is not None]
+    if not games:
+        g.skip_view_cache = True
     return render_template("index.html", games=games)
 
 
@@ -262,31 +524,33 @@ def search():
     search_url = f"https://steamcommunity.com/actions/SearchApps/{requests.utils.requote_uri(q)}"
 
     try:
-        r = requests.get(search_url, timeout=8)
+        r = SESSION.get(search_url, timeout=8)
         r.raise_for_status()
-        results = r.json()
+        results = orjson.loads(r.content)
     except:
         results = []
 
-    enriched = []
-    for item in results[:9]:
-        appid = item.get("appid")
-        details = get_steam_game(appid)
-        if details:
-            enriched.append(details)
+    appids = [item.get("appid") for item in results[:9]]
+    enriched = [g for g in get_steam_games(appids) if g is not None]
 
     return render_template("search_results.html", query=q, results=enriched)
 
 
 @app.route("/game/<int:appid>")
+@cache.cached(
+    timeout=120,
+    unless=_has_flashes,
+    response_filter=_cacheable_view,
+    make_cache_key=_game_detail_cache_key,
+)
 def game_detail(appid):
-    g = get_steam_game(appid)
-    if not g:
+    game = get_steam_game(appid)
+    if not game:
         flash("Game details unavailable.", "warning")
         return redirect(url_for("index"))
 
     reviews = get_reviews_for_app(appid)
-    return render_template("game_detail.html", game=g, reviews=reviews)
+    return render_template("game_detail.html", game=game, reviews=reviews)
 
 
 @app.route("/game/<int:appid>/review", methods=["POST"])
@@ -299,6 +563,7 @@ def add_review_route(appid):
         return redirect(url_for("game_detail", appid=appid))
 
     add_review_db(appid, rating, text)
+    cache.delete(_game_detail_cache_key(appid))
     flash("Review submitted!", "success")
     return redirect(url_for("game_detail", appid=appid))
 
@@ -341,6 +606,7 @@ def favourites_remove():
 # Auto-create database
 with app.app_context():
     db.create_all()
+    upgrade_db()
 
 
 
@@ -0,0 +1,11 @@
+import multiprocessing
+
+# Gunicorn settings for running the app in production:
+#   gunicorn -c gunicorn_conf.py app:app
+
+bind = "0.0.0.0:8000"
+worker_class = "gevent"
+workers = max(2, multiprocessing.cpu_count())
+worker_connections = 1000
+keepalive = 5
+timeout = 30